@@ -0,0 +1,368 @@
+# api_server.py
+"""
+Looma AI 生成流水线的 HTTP 接口（纯 ASGI，不依赖 Streamlit）。
+
+    python api_server.py --host 127.0.0.1 --port 8000      # 需要 uvicorn
+
+接口：
+    POST /parse                     {"text": "...", "image_base64": "..."(可选)}
+    POST /optimize                  {"design": {...}, "mode": "智能模式"}
+    POST /generate                  {"design": {...}, "mode": "智能模式", "optimize": true}
+    POST /grade                     {"design": {...}, "sizes": {"S": {"bust": -4}, ...}}  → 流式 ZIP
+    GET  /designs/{id}              设计记录（参数、耗时、产物链接）
+    GET  /designs/{id}/nearest      相近历史版型
+    GET  /designs/{id}/artifacts/{kind}   流式返回 preview/dxf/json
+    GET  /designs/{id}/bundle             流式返回 ZIP 包
+
+渲染（matplotlib/PIL/ezdxf）在进程池中执行，避免占用事件循环与 GIL；
+解码上传图片、打包 ZIP、读文件等阻塞操作在线程池中执行，不阻塞其他请求；
+设计库、产物存档与 ZIP 缓存与 app.py 共用同一 OUTPUT_DIR。
+"""
+import os
+import re
+import json
+import time
+import base64
+import shutil
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from deepseek_engine import parse_with_deepseek
+from ai_optimizer import optimize
+from pattern_engine import generate_pattern, JOB_DIR
+from image_pipeline import decode_upload
+from bundle_packager import open_bundle, design_members, is_safe_name, CHUNK_SIZE
+from design_store import DesignStore
+from pattern_library import PatternLibrary
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+DEFAULT_WORKERS = int(os.environ.get("LOOMA_API_WORKERS", "0")) or max(1, (os.cpu_count() or 2) - 1)
+# 默认放码规则（cm，相对基准尺码）
+DEFAULT_GRADE = {
+    "S": {"bust": -4, "waist": -4, "hip": -4, "shoulder": -1},
+    "M": {},
+    "L": {"bust": 4, "waist": 4, "hip": 4, "shoulder": 1},
+}
+CONTENT_TYPES = {".png": "image/png", ".dxf": "application/dxf", ".json": "application/json",
+                 ".zip": "application/zip"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _render_job(design, job_dir):
+    """进程池任务：在独立目录中生成预览/DXF/JSON，返回 (generate_pattern 结果, 耗时秒)"""
+    t0 = time.perf_counter()
+    res = generate_pattern(design, output_dir=job_dir)
+    return res, round(time.perf_counter() - t0, 4)
+
+
+def _validate_design(design):
+    """
+    garment 会拼进 generate_pattern 的输出文件名与 ZIP 包内文件名，
+    含路径分隔符或 .. 时可写出任务目录之外（路径穿越/zip-slip），必须在渲染前拒绝。
+    """
+    if not isinstance(design, dict):
+        raise HTTPError(400, "design must be an object")
+    garment = design.get("garment")
+    if garment is not None and not is_safe_name(garment):
+        raise HTTPError(400, "invalid garment name")
+    return design
+
+
+def _apply_grade(design, deltas):
+    if not isinstance(deltas, dict):
+        raise HTTPError(400, "each size must be an object of {field: delta_cm}")
+    graded = dict(design)
+    for k, d in (deltas or {}).items():
+        try:
+            graded[k] = float(graded.get(k) or 0) + float(d)
+        except (TypeError, ValueError):
+            raise HTTPError(400, f"invalid grade delta for {k!r}")
+    return graded
+
+
+class LoomaAPI:
+    """ASGI 应用：进程池、设计库与版型索引在 lifespan 中创建，所有请求共享"""
+
+    def __init__(self, workers=DEFAULT_WORKERS, store=None):
+        self.workers = workers
+        self.store = store
+        self.library = None
+        self.pool = None
+        self.routes = [
+            ("POST", re.compile(r"^/parse$"), self.parse),
+            ("POST", re.compile(r"^/optimize$"), self.optimize),
+            ("POST", re.compile(r"^/generate$"), self.generate),
+            ("POST", re.compile(r"^/grade$"), self.grade),
+            ("GET", re.compile(r"^/designs/(\d+)$"), self.get_design),
+            ("GET", re.compile(r"^/designs/(\d+)/nearest$"), self.nearest),
+            ("GET", re.compile(r"^/designs/(\d+)/artifacts/(\w+)$"), self.artifact),
+            ("GET", re.compile(r"^/designs/(\d+)/bundle$"), self.bundle),
+            ("GET", re.compile(r"^/health$"), self.health),
+        ]
+
+    # ---------- 生命周期 ----------
+    def startup(self):
+        os.makedirs(JOB_DIR, exist_ok=True)
+        if self.store is None:
+            self.store = DesignStore()
+        if self.library is None:
+            self.library = PatternLibrary.from_store(self.store)
+        if self.pool is None:
+            # spawn：子进程不继承事件循环线程与 SQLite 连接
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    try:
+                        self.startup()
+                    except Exception as e:
+                        await send({"type": "lifespan.startup.failed", "message": str(e)})
+                        return
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    self.shutdown()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        if self.pool is None:
+            self.startup()
+        started = False
+
+        async def tracked_send(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            for method, pattern, handler in self.routes:
+                m = pattern.match(scope["path"])
+                if m:
+                    if scope["method"] != method:
+                        raise HTTPError(405, "method not allowed")
+                    await handler(scope, receive, tracked_send, *m.groups())
+                    return
+            raise HTTPError(404, "not found")
+        except Exception as e:
+            if started:  # 响应头已发出，无法再改为错误响应
+                raise
+            if isinstance(e, HTTPError):
+                await _send_json(send, e.status, {"error": e.message})
+            else:
+                await _send_json(send, 500, {"error": str(e)})
+
+    # ---------- 工具 ----------
+    async def _run_render(self, design):
+        job_dir = tempfile.mkdtemp(dir=JOB_DIR)
+        loop = asyncio.get_running_loop()
+        try:
+            res, elapsed = await loop.run_in_executor(self.pool, _render_job, design, job_dir)
+            # 存档会把产物复制到内容寻址目录，之后临时目录即可删除
+            design_id = await loop.run_in_executor(
+                None, lambda: self.store.record(design, res, {"generate": elapsed}))
+            return design_id, elapsed
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def _design_links(self, design_id):
+        arts = self.store.artifacts(design_id)
+        links = {k: f"/designs/{design_id}/artifacts/{k}" for k in arts}
+        links["bundle"] = f"/designs/{design_id}/bundle"
+        return links
+
+    # ---------- 接口 ----------
+    async def health(self, scope, receive, send):
+        await asyncio.get_running_loop().run_in_executor(None, self.library.refresh, self.store)
+        await _send_json(send, 200, {"status": "ok", "workers": self.workers, "designs": len(self.library)})
+
+    async def parse(self, scope, receive, send):
+        body = await _read_json(receive)
+        loop = asyncio.get_running_loop()
+        image = None
+        if body.get("image_base64"):
+            try:
+                image, _thumb = await loop.run_in_executor(
+                    None, lambda: decode_upload(base64.b64decode(body["image_base64"])))
+            except Exception:
+                raise HTTPError(400, "invalid image_base64")
+        # 解析会调用外部模型接口，同样放到线程池
+        parsed = await loop.run_in_executor(
+            None, lambda: parse_with_deepseek(body.get("text", ""), inspiration_image=image))
+        await _send_json(send, 200, parsed)
+
+    async def optimize(self, scope, receive, send):
+        body = await _read_json(receive)
+        design = _validate_design(body.get("design") or {})
+        await _send_json(send, 200, optimize(design, body.get("mode", "智能模式")))
+
+    async def generate(self, scope, receive, send):
+        body = await _read_json(receive)
+        design = _validate_design(body.get("design") or {})
+        if body.get("optimize", True):
+            design = optimize(design, body.get("mode", "智能模式"))
+        design_id, elapsed = await self._run_render(design)
+        await _send_json(send, 200, {"design_id": design_id, "design": design,
+                                     "timings": {"generate": elapsed},
+                                     "artifacts": self._design_links(design_id)})
+
+    async def grade(self, scope, receive, send):
+        """按尺码并行生成，返回包含各尺码文件的流式 ZIP"""
+        body = await _read_json(receive)
+        base = _validate_design(body.get("design") or {})
+        sizes = body.get("sizes") or DEFAULT_GRADE
+        if not isinstance(sizes, dict):
+            raise HTTPError(400, "sizes must be an object of {size: {field: delta_cm}}")
+        # 尺码名会成为 ZIP 包内目录名
+        for name in sizes:
+            if not is_safe_name(name):
+                raise HTTPError(400, f"invalid size name {name!r}")
+        if body.get("optimize", True):
+            base = optimize(base, body.get("mode", "智能模式"))
+        graded = {name: _apply_grade(base, deltas) for name, deltas in sizes.items()}
+        results = await asyncio.gather(*(self._run_render(d) for d in graded.values()))
+        members = []
+        for name, (design_id, _elapsed) in zip(graded, results):
+            members += design_members(self.store.artifacts(design_id), base.get("garment"), prefix=f"{name}/")
+        headers = [(b"x-design-ids", ",".join(str(r[0]) for r in results).encode()),
+                   (b"content-disposition", b'attachment; filename="graded.zip"')]
+        # 打包（哈希、DEFLATE 写盘）在线程池中执行
+        bundle_file = await asyncio.get_running_loop().run_in_executor(None, open_bundle, members)
+        await _send_stream(send, "application/zip", _iter_fileobj(bundle_file), headers)
+
+    def _require_design(self, design_id):
+        record = self.store.get(int(design_id))
+        if record is None:
+            raise HTTPError(404, "design not found")
+        return record
+
+    async def get_design(self, scope, receive, send, design_id):
+        record = self._require_design(design_id)
+        record["artifacts"] = self._design_links(record["id"])
+        await _send_json(send, 200, record)
+
+    async def nearest(self, scope, receive, send, design_id):
+        record = self._require_design(design_id)
+        # 索引按设计库增量同步，Streamlit 或其他 worker 新生成的设计也能匹配到
+        await asyncio.get_running_loop().run_in_executor(None, self.library.refresh, self.store)
+        matches = [m for m in self.library.nearest(record["params"], k=6) if m["design_id"] != record["id"]]
+        await _send_json(send, 200, {"design_id": record["id"], "nearest": matches[:5]})
+
+    async def artifact(self, scope, receive, send, design_id, kind):
+        path = self.store.artifacts(int(design_id)).get(kind)
+        if not path:
+            raise HTTPError(404, "artifact not found")
+        ctype = CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+        await _send_stream(send, ctype, _iter_file(path), [(b"content-length", str(os.path.getsize(path)).encode())])
+
+    async def bundle(self, scope, receive, send, design_id):
+        record = self._require_design(design_id)
+        members = design_members(self.store.artifacts(record["id"]), record["garment"])
+        disposition = f'attachment; filename="design_{record["id"]}.zip"'.encode()
+        bundle_file = await asyncio.get_running_loop().run_in_executor(None, open_bundle, members)
+        await _send_stream(send, "application/zip", _iter_fileobj(bundle_file),
+                           [(b"content-disposition", disposition)])
+
+
+def _iter_file(path):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            yield chunk
+
+
+def _iter_fileobj(f):
+    """按块读取已打开的文件，读完后关闭"""
+    with f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            yield chunk
+
+
+async def _read_json(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise HTTPError(413, "request body too large")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    raw = b"".join(chunks)
+    if not raw:
+        return {}
+    try:
+        body = json.loads(raw)
+    except ValueError:
+        raise HTTPError(400, "invalid JSON body")
+    if not isinstance(body, dict):
+        raise HTTPError(400, "JSON body must be an object")
+    return body
+
+
+async def _send_json(send, status, obj):
+    payload = json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json; charset=utf-8"),
+                            (b"content-length", str(len(payload)).encode())]})
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def _send_stream(send, content_type, chunks, headers=()):
+    """
+    分块发送同步迭代器产出的内容，不把整个文件读入内存。
+    每一块都在线程池中读取（磁盘 IO 不阻塞事件循环）；响应头发出后再出错只能提前结束响应体。
+    """
+    loop = asyncio.get_running_loop()
+    chunks = iter(chunks)
+    # 先取首块再发响应头：读文件出错时仍可返回 JSON 错误
+    first = await loop.run_in_executor(None, next, chunks, b"")
+    try:
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type.encode())] + list(headers)})
+        await send({"type": "http.response.body", "body": first, "more_body": True})
+        while True:
+            try:
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+            except Exception:
+                break  # 状态码已发出，不能再返回 JSON 错误，只能结束响应体
+            if chunk is None:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            await loop.run_in_executor(None, close)
+
+
+app = LoomaAPI()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Looma AI HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
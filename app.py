@@ -1,16 +1,20 @@
 # app.py
 import streamlit as st
 import os
-import io
-import zipfile
-from PIL import Image
+import shutil
+import tempfile
 import streamlit.components.v1 as components
+import time
 from datetime import datetime
 
 from ui_theme import apply_theme, show_brand_header, show_watermark
+from image_pipeline import get_cached_upload
 from deepseek_engine import parse_with_deepseek, GARMENT_OPTIONS
-from pattern_engine import generate_pattern
+from pattern_engine import generate_pattern, iter_preview_tiers, encode_preview_file, JOB_DIR, DISPLAY_MAX_WIDTH
 from ai_optimizer import optimize
+from bundle_packager import open_bundle, design_members, hashed_bundle_digest
+from design_store import DesignStore
+from pattern_library import PatternLibrary
 
 # ------------------------
 # 页面配置与主题
@@ -29,6 +33,7 @@ _defaults = {
     "parsed_cache": None,           # 缓存 AI 解析结果（用于安全填充）
     "ai_locked_fields": [],         # 被 AI 填写且锁定的字段（list）
     "ai_suggestions": [],
+    "upload_cache": {},             # 上传图片解码缓存（按文件摘要，每会话仅解码一次）
 
     # 基本字段默认（会成为 widget 的初始值）
     "notes_input": "",
@@ -113,22 +118,97 @@ else:
 
 st.markdown("---")
 
+# 相似历史版型的最大归一化距离（约等于每项尺寸相差 1～2 cm）
+NEAREST_MAX_DISTANCE = 1.0
+
 # ------------------------
 # 辅助函数
 # ------------------------
-def _get_uploaded_image_from_state():
-    """从 session_state['uploader'] 中读取 PIL.Image（如果存在）"""
+def _get_uploaded_entry_from_state():
+    """从 session_state['uploader'] 取已解码图片缓存项（按文件摘要，每个文件只解码一次）"""
     f = st.session_state.get("uploader")
     if not f:
         return None
     try:
         # f 是 UploadedFile-like
-        f.seek(0)
-        img = Image.open(f)
-        return img
+        return get_cached_upload(st.session_state["upload_cache"], f.getvalue())
     except Exception:
         return None
 
+def _get_uploaded_image_from_state():
+    """返回有界工作分辨率的 PIL.Image（如果存在）"""
+    entry = _get_uploaded_entry_from_state()
+    return entry["working"] if entry else None
+
+@st.cache_resource
+def _get_design_store():
+    """进程内共享的设计历史库（SQLite）"""
+    return DesignStore()
+
+@st.cache_resource
+def _get_pattern_library():
+    """历史版型最近邻索引（启动时从设计库加载，之后由 _refreshed_pattern_library 增量同步）"""
+    return PatternLibrary.from_store(_get_design_store())
+
+def _refreshed_pattern_library():
+    """增量加载设计库中的新设计（包括 API 等其他进程生成的）后返回索引"""
+    library = _get_pattern_library()
+    library.refresh(_get_design_store())
+    return library
+
+def _collect_design_input():
+    """从表单（session_state）收集当前设计参数"""
+    return {
+        "garment": st.session_state.get("garment"),
+        "color": st.session_state.get("color_picker"),
+        "material": st.session_state.get("material_input"),
+        "height": st.session_state.get("height"),
+        "bust": st.session_state.get("bust"),
+        "waist": st.session_state.get("waist"),
+        "hip": st.session_state.get("hip"),
+        "shoulder": st.session_state.get("shoulder"),
+        "torso_length": st.session_state.get("torso_length"),
+        "neck_type": st.session_state.get("neck_type"),
+        "sleeve_length": st.session_state.get("sleeve_length"),
+        "sleeve_width": st.session_state.get("sleeve_width"),
+        "sleeve_cap_height": st.session_state.get("sleeve_cap_height"),
+        "seam": st.session_state.get("seam"),
+        "ease": st.session_state.get("ease"),
+        "hem_depth": st.session_state.get("hem_depth"),
+        "notes": st.session_state.get("notes_input")
+    }
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _archived_display_image(path):
+    """存档预览的展示小图（WebP/JPEG）；存档路径按内容寻址，同一路径每进程只解码一次"""
+    data, _fmt = encode_preview_file(path, max_width=DISPLAY_MAX_WIDTH["mobile"])
+    return data
+
+def _show_archived_design(design_id, garment, key_prefix):
+    """
+    展示历史设计的存档预览小图；文件包只在用户点击后才打包/读取。
+    包哈希由库中记录的 sha1 计算，不重读存档文件。
+    """
+    records = _get_design_store().artifact_records(design_id)
+    if records.get("preview"):
+        st.image(_archived_display_image(records["preview"][0]), use_column_width=True,
+                 caption=f"历史设计 #{design_id}")
+    arts = {kind: path for kind, (path, _sha1) in records.items()}
+    members = design_members(arts, garment)
+    if not members:
+        return
+    flag = f"{key_prefix}_bundle_for"
+    if st.session_state.get(flag) != design_id:
+        if st.button("📦 准备历史文件包", key=f"{key_prefix}_prepare", use_container_width=True):
+            st.session_state[flag] = design_id
+            st.rerun()
+        return
+    sha1_by_path = {path: sha1 for path, sha1 in records.values()}
+    with open_bundle(members, digest=hashed_bundle_digest(members, sha1_by_path)) as bundle_file:
+        st.download_button("⬇️ 下载历史文件包", bundle_file,
+                           file_name=f"{garment or 'design'}_{design_id}.zip", mime="application/zip",
+                           key=f"{key_prefix}_download", use_container_width=True)
+
 def _apply_parsed_to_cache_and_rerun(parsed):
     """把解析结果放入 parsed_cache 并触发 rerun（st.rerun）"""
     st.session_state["parsed_cache"] = parsed
@@ -164,18 +244,18 @@ with col_main:
     st.subheader("📥 灵感图片（可选）")
     # 使用 key 'uploader'，文件会存放在 session_state['uploader']
     st.file_uploader("上传灵感图片（jpg/png）", type=["jpg", "jpeg", "png"], key="uploader")
-    uploaded_img = _get_uploaded_image_from_state()
-    if uploaded_img:
-        st.image(uploaded_img, use_column_width=True, caption="灵感图预览")
+    uploaded_entry = _get_uploaded_entry_from_state()
+    if uploaded_entry:
+        st.image(uploaded_entry["thumbnail"], use_column_width=True, caption="灵感图预览")
 
     st.markdown("### 🎨 口语化描述（实时解析）")
 
     # on_change 回调：当文本框内容改变并失去焦点时触发解析
     def _on_notes_change():
         txt = st.session_state.get("notes_input", "").strip()
-        if len(txt) < 3 and _get_uploaded_image_from_state() is None:
-            return
         insp = _get_uploaded_image_from_state()
+        if len(txt) < 3 and insp is None:
+            return
         try:
             parsed = parse_with_deepseek(txt, inspiration_image=insp)
         except Exception:
@@ -188,10 +268,10 @@ with col_main:
     st.markdown("")
     if st.button("✨ 解析并填充表单（手动）"):
         txt = st.session_state.get("notes_input", "").strip()
-        if not txt and not _get_uploaded_image_from_state():
+        insp = _get_uploaded_image_from_state()
+        if not txt and insp is None:
             st.error("请先输入描述或上传灵感图片以供解析。")
         else:
-            insp = _get_uploaded_image_from_state()
             try:
                 parsed = parse_with_deepseek(txt, inspiration_image=insp)
             except Exception:
@@ -242,75 +322,111 @@ with col_side:
         ease = st.number_input("整体松量 Ease (cm)", 0.0, 15.0, key="ease")
         hem_depth = st.number_input("下摆深度 / 裙摆高度 (cm)", 0.0, 80.0, key="hem_depth")
 
+    # 相似历史版型：尺寸相差很小的老设计可直接复用其文件，无需重新生成
+    try:
+        nearest = _refreshed_pattern_library().nearest(_collect_design_input(), k=1, max_distance=NEAREST_MAX_DISTANCE)
+    except Exception:
+        nearest = []
+    if nearest:
+        match = nearest[0]
+        diffs = "，".join(f"{k} {v:+.1f}" for k, v in match["deltas"].items() if abs(v) >= 0.1)
+        diffs = f"差值：{diffs} cm" if diffs else "尺寸一致"
+        with st.expander(f"♻️ 找到相近的历史版型 #{match['design_id']}（{diffs}）", expanded=False):
+            if not match["exact_match"]:
+                st.caption("同品类，但版型或面料不同，请核对。")
+            _show_archived_design(match["design_id"], st.session_state.get("garment"), "nearest")
+
     st.markdown("---")
     # 生成按钮（桌面/手机都显示）
     if st.button("🚀 生成设计与打版（2D）", use_container_width=True):
-        design_input = {
-            "garment": st.session_state.get("garment"),
-            "color": st.session_state.get("color_picker"),
-            "material": st.session_state.get("material_input"),
-            "height": st.session_state.get("height"),
-            "bust": st.session_state.get("bust"),
-            "waist": st.session_state.get("waist"),
-            "hip": st.session_state.get("hip"),
-            "shoulder": st.session_state.get("shoulder"),
-            "torso_length": st.session_state.get("torso_length"),
-            "neck_type": st.session_state.get("neck_type"),
-            "sleeve_length": st.session_state.get("sleeve_length"),
-            "sleeve_width": st.session_state.get("sleeve_width"),
-            "sleeve_cap_height": st.session_state.get("sleeve_cap_height"),
-            "seam": st.session_state.get("seam"),
-            "ease": st.session_state.get("ease"),
-            "hem_depth": st.session_state.get("hem_depth"),
-            "notes": st.session_state.get("notes_input")
-        }
+        design_input = _collect_design_input()
 
         mode_for_opt = "智能模式" if st.session_state["mobile_mode"] else st.session_state.get("mode_select", "智能模式（新手）")
 
+        timings = {}
+        t0 = time.perf_counter()
         try:
             optimized = optimize(design_input, mode_for_opt)
         except Exception as e:
             st.error(f"参数优化失败：{e}")
             optimized = design_input
+        timings["optimize"] = round(time.perf_counter() - t0, 4)
 
         # suggestions
         st.session_state["ai_suggestions"] = generate_suggestions(optimized)
 
-        # generate pattern
+        # 每次生成写入独立的临时目录：共享的 output/preview.png 等会被并发会话互相覆盖，
+        # 存档与打包都从本次目录读取，完成后删除
+        os.makedirs(JOB_DIR, exist_ok=True)
+        run_dir = tempfile.mkdtemp(prefix="app_", dir=JOB_DIR)
         try:
-            res = generate_pattern(optimized)
-        except Exception as e:
-            st.error(f"生成图纸失败：{e}")
-            res = None
-
-        if res:
-            st.success("✅ 生成成功，向下查看预览与下载")
-            # 自动滚动到页面底部
-            components.html("<script>window.scrollTo({ top: document.body.scrollHeight, behavior: 'smooth' });</script>", height=0)
-
-            preview_path = res.get("preview")
-            if preview_path and os.path.exists(preview_path):
-                st.image(preview_path, use_column_width=True, caption="2D 成品预览 · 张小鱼原创")
-
-            # 打包 ZIP
-            zip_buf = io.BytesIO()
-            with zipfile.ZipFile(zip_buf, "w") as zf:
-                if preview_path and os.path.exists(preview_path):
-                    zf.write(preview_path, os.path.basename(preview_path))
-                if res.get("dxf") and os.path.exists(res["dxf"]):
-                    zf.write(res["dxf"], os.path.basename(res["dxf"]))
-                if res.get("json") and os.path.exists(res["json"]):
-                    zf.write(res["json"], os.path.basename(res["json"]))
-            zip_buf.seek(0)
-            st.download_button("⬇️ 下载完整文件包 (PNG + DXF + JSON)", zip_buf.read(),
-                               file_name=f"{design_input.get('garment','design')}_{datetime.now().strftime('%Y%m%d')}.zip",
-                               use_container_width=True)
-
-            # show suggestions
-            if st.session_state.get("ai_suggestions"):
-                st.warning("⚠ AI 优化建议（请核对）")
-                for s in st.session_state["ai_suggestions"]:
-                    st.write("•", s)
+            # 渐进式预览：先显示低清草图，再替换为展示图（WebP/JPEG）；高清 PNG 只进下载包
+            t0 = time.perf_counter()
+            preview_slot = st.empty()
+            preview_path = os.path.join(run_dir, "preview.png")
+            try:
+                for tier, img_bytes, _fmt in iter_preview_tiers(optimized, output_path=preview_path,
+                                                                mobile=st.session_state["mobile_mode"]):
+                    caption = "2D 成品预览（草图）· 张小鱼原创" if tier == "draft" else "2D 成品预览 · 张小鱼原创"
+                    preview_slot.image(img_bytes, use_column_width=True, caption=caption)
+            except Exception:
+                preview_slot.empty()
+                preview_path = None
+
+            # generate pattern
+            try:
+                res = generate_pattern(optimized, preview_path=preview_path, output_dir=run_dir)
+            except Exception as e:
+                st.error(f"生成图纸失败：{e}")
+                res = None
+            timings["generate"] = round(time.perf_counter() - t0, 4)
+
+            if res:
+                st.success("✅ 生成成功，向下查看预览与下载")
+                # 自动滚动到页面底部
+                components.html("<script>window.scrollTo({ top: document.body.scrollHeight, behavior: 'smooth' });</script>", height=0)
+
+                preview_path = res.get("preview")
+
+                # 写入设计历史库（失败不影响本次下载）
+                try:
+                    _get_design_store().record(optimized, res, timings)
+                    _refreshed_pattern_library()
+                except Exception:
+                    pass
+
+                # 打包 ZIP（按内容哈希缓存在磁盘上；PNG 直接存储，只压缩 DXF/JSON）
+                with open_bundle([preview_path, res.get("dxf"), res.get("json")]) as bundle_file:
+                    st.download_button("⬇️ 下载完整文件包 (PNG + DXF + JSON)", bundle_file,
+                                       file_name=f"{design_input.get('garment','design')}_{datetime.now().strftime('%Y%m%d')}.zip",
+                                       mime="application/zip", use_container_width=True)
+
+                # show suggestions
+                if st.session_state.get("ai_suggestions"):
+                    st.warning("⚠ AI 优化建议（请核对）")
+                    for s in st.session_state["ai_suggestions"]:
+                        st.write("•", s)
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+# ------------------------
+# 历史设计：复单时直接取用已存档的文件，不重新渲染
+# ------------------------
+st.markdown("---")
+with st.expander("🕘 历史设计（复单）", expanded=False):
+    try:
+        history = _get_design_store().recent(limit=20)
+    except Exception:
+        history = []
+    if not history:
+        st.caption("暂无历史设计。")
+    else:
+        picked = st.selectbox(
+            "选择历史设计", history,
+            format_func=lambda r: f"#{r['id']} · {r['created_at']} · {r['garment'] or '设计'} · "
+                                  f"胸{r['bust'] or '-'} 腰{r['waist'] or '-'} 臀{r['hip'] or '-'}",
+            key="history_select")
+        _show_archived_design(picked["id"], picked["garment"], "history")
 
 st.markdown("---")
 st.markdown("© 张小鱼原创 · Looma AI 2026")
@@ -0,0 +1,157 @@
+# bundle_packager.py
+import os
+import re
+import shutil
+import hashlib
+import zipfile
+import tempfile
+
+from pattern_engine import OUTPUT_DIR
+
+BUNDLE_DIR = os.path.join(OUTPUT_DIR, "bundles")
+CHUNK_SIZE = 64 * 1024
+# 已压缩格式直接存储，重复 deflate 只耗 CPU 不省空间
+STORED_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".zip", ".gz"}
+# 缓存包数量上限，超出后删除最旧的
+MAX_CACHED_BUNDLES = 64
+
+
+def _compress_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTS else zipfile.ZIP_DEFLATED
+
+
+def _members(paths):
+    """
+    过滤掉不存在的文件，返回 [(path, arcname)]，顺序与输入一致。
+    paths 中的元素可以是路径，也可以是 (path, arcname) 以指定包内文件名。
+    """
+    out = []
+    for p in paths:
+        p, arcname = p if isinstance(p, tuple) else (p, None)
+        if p and os.path.exists(p):
+            out.append((p, arcname or os.path.basename(p)))
+    return out
+
+
+_UNSAFE_NAME_RE = re.compile(r"[/\\:\x00-\x1f]|\.\.")
+
+
+def is_safe_name(name):
+    """可用作文件名/包内目录名片段：非空字符串，且不含路径分隔符、盘符冒号、控制字符与 .."""
+    return isinstance(name, str) and bool(name.strip()) and not _UNSAFE_NAME_RE.search(name)
+
+
+def design_members(artifacts, garment=None, prefix=""):
+    """把存档产物 {kind: path} 映射为带可读包内文件名的成员列表（与 generate_pattern 的命名一致）"""
+    g = garment if is_safe_name(garment) else "design"
+    names = {"preview": "preview.png", "dxf": f"{g}_pattern.dxf", "json": f"{g}_design.json"}
+    return [(artifacts.get(kind), prefix + name) for kind, name in names.items() if artifacts.get(kind)]
+
+
+def bundle_digest(paths):
+    """按成员文件名与内容计算包的内容哈希（分块读取，不整体载入内存）"""
+    h = hashlib.sha1()
+    for path, arcname in _members(paths):
+        h.update(arcname.encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def hashed_bundle_digest(members, sha1_by_path):
+    """
+    成员内容哈希已知时（如设计库 artifacts 表中的 sha1），直接由 (包内文件名, sha1) 计算包哈希，不读文件。
+    members 为 [(path, arcname)]，sha1_by_path 为 {path: sha1}。
+    """
+    h = hashlib.sha1(b"hashed\0")
+    for path, arcname in members:
+        h.update(arcname.encode("utf-8") + b"\0" + sha1_by_path[path].encode("ascii") + b"\0")
+    return h.hexdigest()
+
+
+def write_bundle(paths, fileobj):
+    """
+    把文件流式写入 ZIP：PNG 等已压缩成员以 STORED 存储，DXF/JSON 以 DEFLATE 压缩。
+    fileobj 可以是磁盘文件，也可以是不可 seek 的流（如 HTTP 响应体）。
+    """
+    with zipfile.ZipFile(fileobj, "w") as zf:
+        for path, arcname in _members(paths):
+            ctype = _compress_type(path)
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = ctype
+            with open(path, "rb") as src, zf.open(info, "w") as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def _prune(bundle_dir, keep=MAX_CACHED_BUNDLES, protect=None):
+    """按最近使用时间（命中时会刷新 mtime）淘汰旧包，protect 为刚生成、即将返回的包"""
+    try:
+        entries = [os.path.join(bundle_dir, n) for n in os.listdir(bundle_dir) if n.endswith(".zip")]
+    except OSError:
+        return
+    if len(entries) <= keep:
+        return
+    mtimes = {}
+    for p in entries:
+        try:
+            mtimes[p] = os.path.getmtime(p)
+        except OSError:  # 已被其他进程删除
+            pass
+    candidates = sorted((p for p in mtimes if p != protect), key=mtimes.get)
+    for p in candidates[:len(mtimes) - keep]:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+
+def build_bundle(paths, bundle_dir=BUNDLE_DIR, digest=None):
+    """
+    生成（或复用）磁盘上的 ZIP 包，返回其路径。
+    以内容哈希命名，相同成员内容不会重复打包；先写临时文件再原子替换，避免读到半成品。
+    digest 已知（见 hashed_bundle_digest）时直接使用，省去逐个读取成员文件计算哈希。
+    缓存命中时刷新 mtime，使 _prune 按最近使用淘汰；包恰好已被淘汰时重新生成。
+    """
+    os.makedirs(bundle_dir, exist_ok=True)
+    bundle_path = os.path.join(bundle_dir, f"{digest or bundle_digest(paths)}.zip")
+    try:
+        os.utime(bundle_path)
+        return bundle_path
+    except FileNotFoundError:
+        pass
+    fd, tmp_path = tempfile.mkstemp(suffix=".zip.tmp", dir=bundle_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write_bundle(paths, f)
+        os.replace(tmp_path, bundle_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _prune(bundle_dir, protect=bundle_path)
+    return bundle_path
+
+
+def open_bundle(paths, bundle_dir=BUNDLE_DIR, digest=None, retries=2):
+    """
+    生成（或复用）ZIP 包并以二进制只读方式打开。
+    build_bundle 返回后、打开前，包可能被其他进程的 _prune 删除，此时重新生成；
+    打开后即使被删除，已打开的文件句柄仍可完整读取。
+    """
+    for attempt in range(retries + 1):
+        bundle_path = build_bundle(paths, bundle_dir=bundle_dir, digest=digest)
+        try:
+            return open(bundle_path, "rb")
+        except FileNotFoundError:
+            if attempt == retries:
+                raise
+
+
+def iter_bundle_chunks(paths, chunk_size=CHUNK_SIZE, bundle_dir=BUNDLE_DIR, digest=None):
+    """按块产出 ZIP 包内容（基于磁盘缓存），用于 HTTP 分块响应，不在内存中持有整包"""
+    with open_bundle(paths, bundle_dir=bundle_dir, digest=digest) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
@@ -0,0 +1,214 @@
+# design_store.py
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from datetime import datetime
+
+from pattern_engine import OUTPUT_DIR
+
+DB_PATH = os.environ.get("LOOMA_DB_PATH") or os.path.join(OUTPUT_DIR, "designs.sqlite3")
+# 产物按内容哈希存放，generate_pattern 每次覆盖 output/preview.png，历史订单需要自己的副本
+ARTIFACT_DIR = os.path.join(OUTPUT_DIR, "artifacts")
+MEASURE_FIELDS = ["height", "bust", "waist", "hip", "shoulder", "torso_length"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS designs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    garment TEXT,
+    fit TEXT,
+    material TEXT,
+    height REAL, bust REAL, waist REAL, hip REAL, shoulder REAL, torso_length REAL,
+    params TEXT NOT NULL,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_designs_garment_created ON designs (garment, created_at);
+CREATE INDEX IF NOT EXISTS idx_designs_created ON designs (created_at);
+CREATE INDEX IF NOT EXISTS idx_designs_measure ON designs (bust, waist, hip);
+CREATE TABLE IF NOT EXISTS artifacts (
+    design_id INTEGER NOT NULL REFERENCES designs (id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    sha1 TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    PRIMARY KEY (design_id, kind)
+);
+CREATE INDEX IF NOT EXISTS idx_artifacts_sha1 ON artifacts (sha1);
+"""
+
+
+def _sha1_file(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _to_float(value):
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _archive_artifact(path, artifact_dir):
+    """把产物复制到内容寻址目录，相同内容只保存一份，返回 (sha1, 存档路径, 大小)"""
+    digest = _sha1_file(path)
+    ext = os.path.splitext(path)[1].lower()
+    target = os.path.join(artifact_dir, f"{digest}{ext}")
+    if not os.path.exists(target):
+        # 临时文件名唯一，多个进程同时存档同一内容时互不覆盖；os.replace 原子落盘
+        fd, tmp = tempfile.mkstemp(suffix=ext + ".tmp", dir=artifact_dir)
+        try:
+            with os.fdopen(fd, "wb") as dst, open(path, "rb") as src:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp, target)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return digest, target, os.path.getsize(target)
+
+
+class DesignStore:
+    """
+    本地设计历史库（SQLite，WAL 模式）。
+    每条记录保存解析/优化后的参数、产物哈希与耗时；产物另存到内容寻址目录，复单时直接取用，无需重新渲染。
+    """
+
+    def __init__(self, db_path=DB_PATH, artifact_dir=ARTIFACT_DIR):
+        self.db_path = db_path
+        self.artifact_dir = artifact_dir
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        os.makedirs(artifact_dir, exist_ok=True)
+        # Streamlit 每次 rerun 可能在不同线程执行，连接共享并用锁串行化写入
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _insert(self, design, artifacts, timings, created_at):
+        row = [
+            created_at or datetime.now().isoformat(timespec="seconds"),
+            design.get("garment"), design.get("fit"), design.get("material"),
+        ] + [_to_float(design.get(k)) for k in MEASURE_FIELDS] + [
+            json.dumps(design, ensure_ascii=False, default=str),
+            json.dumps(timings or {}),
+        ]
+        cur = self._conn.execute(
+            "INSERT INTO designs (created_at, garment, fit, material, height, bust, waist, hip, shoulder,"
+            " torso_length, params, timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        design_id = cur.lastrowid
+        art_rows = []
+        for kind, path in (artifacts or {}).items():
+            if not path or not os.path.exists(path):
+                continue
+            digest, stored, size = _archive_artifact(path, self.artifact_dir)
+            art_rows.append((design_id, kind, digest, stored, size))
+        if art_rows:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO artifacts (design_id, kind, sha1, path, size) VALUES (?, ?, ?, ?, ?)",
+                art_rows)
+        return design_id
+
+    def record(self, design, artifacts=None, timings=None, created_at=None):
+        """
+        记录一次设计。artifacts 形如 generate_pattern 的返回值 {"preview": path, "dxf": path, "json": path}，
+        非路径字段（如 status）会被忽略。返回新记录 id。
+        """
+        return self.record_many([(design, artifacts, timings, created_at)])[0]
+
+    def record_many(self, items):
+        """批量记录（单个事务），items 为 (design, artifacts, timings[, created_at]) 元组序列"""
+        ids = []
+        with self._lock, self._conn:
+            for item in items:
+                design, artifacts, timings = item[0], item[1], item[2]
+                created_at = item[3] if len(item) > 3 else None
+                artifacts = {k: v for k, v in (artifacts or {}).items() if isinstance(v, str) and k != "status"}
+                ids.append(self._insert(design, artifacts, timings, created_at))
+        return ids
+
+    def _row_to_dict(self, row):
+        out = dict(row)
+        out["params"] = json.loads(out["params"])
+        out["timings"] = json.loads(out["timings"] or "{}")
+        return out
+
+    def get(self, design_id):
+        """返回单条设计记录（含 artifacts 路径），不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM designs WHERE id = ?", (design_id,)).fetchone()
+        if row is None:
+            return None
+        out = self._row_to_dict(row)
+        out["artifacts"] = self.artifacts(design_id)
+        return out
+
+    def artifacts(self, design_id):
+        """返回 {kind: 存档路径}，只包含磁盘上仍存在的产物"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, path FROM artifacts WHERE design_id = ?", (design_id,)).fetchall()
+        return {r["kind"]: r["path"] for r in rows if os.path.exists(r["path"])}
+
+    def artifact_records(self, design_id):
+        """返回 {kind: (存档路径, sha1)}，sha1 取自库中记录，调用方无需重读文件计算哈希"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, path, sha1 FROM artifacts WHERE design_id = ?", (design_id,)).fetchall()
+        return {r["kind"]: (r["path"], r["sha1"]) for r in rows if os.path.exists(r["path"])}
+
+    def find(self, garment=None, since=None, until=None, bust=None, waist=None, hip=None,
+             tolerance=2.0, limit=50):
+        """
+        按品类、日期范围（ISO 字符串）及胸/腰/臀围（±tolerance cm）查询，按时间倒序返回。
+        """
+        clauses, args = [], []
+        if garment:
+            clauses.append("garment = ?")
+            args.append(garment)
+        if since:
+            clauses.append("created_at >= ?")
+            args.append(since)
+        if until:
+            clauses.append("created_at <= ?")
+            args.append(until)
+        for col, value in (("bust", bust), ("waist", waist), ("hip", hip)):
+            value = _to_float(value)
+            if value is not None:
+                clauses.append(f"{col} BETWEEN ? AND ?")
+                args.extend([value - tolerance, value + tolerance])
+        sql = "SELECT * FROM designs"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        args.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [self._row_to_dict(r) for r in rows]
+
+    def recent(self, limit=20):
+        return self.find(limit=limit)
+
+    def index_rows(self, since_id=0):
+        """
+        返回建索引所需的轻量字段 (id, garment, fit, material, *MEASURE_FIELDS)，不解析 params JSON。
+        since_id 用于增量加载：只返回 id > since_id 的设计（含其他进程写入的）。
+        """
+        cols = ", ".join(["id", "garment", "fit", "material"] + MEASURE_FIELDS)
+        with self._lock:
+            return [tuple(r) for r in self._conn.execute(
+                f"SELECT {cols} FROM designs WHERE id > ? ORDER BY id", (since_id,))]
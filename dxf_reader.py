@@ -0,0 +1,218 @@
+# dxf_reader.py
+"""
+流式读取 generate_dxf 产出的打版文件：只遍历模型空间中的 LWPOLYLINE/TEXT，
+不构建完整的 ezdxf 文档，用于批量重出预览与缝份一致性检查。
+
+    python dxf_reader.py output/ --workers 8 --report audit.jsonl --preview-dir previews/
+"""
+import os
+import re
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from ezdxf.addons import iterdxf
+
+ENTITY_TYPES = ["LWPOLYLINE", "TEXT"]
+PIECE_LABELS = ["BACK_PIECE", "SLEEVE_PIECE"]
+LEGEND_RE = re.compile(r"^(garment|material|seam|ease):\s*(.*?)(?:\s*cm)?$")
+# 缝份/松量比对容差（cm），legend 中以两位小数写出
+SEAM_TOLERANCE = 0.05
+
+
+def _bbox(points):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def _contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+def _label_piece(cuts, label, insert):
+    """标签写在裁片上沿之上约 1 cm 处：选 x 落在裁片内、且上沿离标签最近的 CUT 裁片"""
+    x, y = insert
+    best, best_gap = None, None
+    for piece in cuts:
+        x0, _y0, x1, y1 = piece["bbox"]
+        if piece["name"] is None and x0 <= x <= x1 and y >= y1:
+            gap = y - y1
+            if best_gap is None or gap < best_gap:
+                best, best_gap = piece, gap
+    if best is not None:
+        best["name"] = label
+
+
+def read_pattern_dxf(path):
+    """
+    读取单个 DXF，返回 {"path", "pieces", "seam_lines", "legend", "measured_seam"}。
+    pieces 为 CUT 层裁片（name 为 FRONT_PIECE/BACK_PIECE/SLEEVE_PIECE），legend 为图例文字解析结果。
+    """
+    cuts, seams, labels, legend = [], [], [], {}
+    # iterdxf.modelspace 只定位并逐个解析 ENTITIES 段中需要的类型，文件不会整体载入内存
+    # （single_pass_modelspace 在 ezdxf 1.4 上会漏掉最后一个实体，不用）
+    for e in iterdxf.modelspace(path, types=ENTITY_TYPES):
+        if e.dxftype() == "LWPOLYLINE":
+            points = [(float(x), float(y)) for x, y in e.get_points("xy")]
+            if not points:
+                continue
+            item = {"layer": e.dxf.layer, "points": points, "bbox": _bbox(points)}
+            if item["layer"] == "CUT":
+                item["name"] = None
+                cuts.append(item)
+            elif item["layer"] == "SEAM":
+                seams.append(item)
+        else:
+            text = e.dxf.text.strip()
+            if text in PIECE_LABELS:
+                labels.append((text, (float(e.dxf.insert.x), float(e.dxf.insert.y))))
+                continue
+            m = LEGEND_RE.match(text)
+            if m:
+                key, value = m.group(1), m.group(2).strip()
+                if key in ("seam", "ease"):
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        pass
+                legend[key] = value
+
+    for label, insert in labels:
+        _label_piece(cuts, label, insert)
+    measured = []
+    for seam in seams:
+        for piece in cuts:
+            if _contains(piece["bbox"], seam["bbox"]):
+                if piece["name"] is None:
+                    piece["name"] = "FRONT_PIECE"
+                ob, ib = piece["bbox"], seam["bbox"]
+                measured.append(min(ib[0] - ob[0], ib[1] - ob[1], ob[2] - ib[2], ob[3] - ib[3]))
+                break
+    for piece in cuts:
+        x0, y0, x1, y1 = piece["bbox"]
+        piece["width"], piece["height"] = round(x1 - x0, 3), round(y1 - y0, 3)
+    return {
+        "path": path,
+        "pieces": cuts,
+        "seam_lines": seams,
+        "legend": legend,
+        "measured_seam": round(min(measured), 3) if measured else None,
+    }
+
+
+def design_from_pattern(info):
+    """
+    按 generate_dxf 的公式从裁片尺寸反推设计参数（胸围、上身长、袖肥），用于不重新解析订单即可重出预览。
+    front_w = bust/4 + ease/4 + seam；sleeve_w = sleeve_width/2 + seam。
+    """
+    legend = info["legend"]
+    seam = legend.get("seam") if isinstance(legend.get("seam"), float) else 1.5
+    ease = legend.get("ease") if isinstance(legend.get("ease"), float) else 4.0
+    design = {"garment": legend.get("garment"), "material": legend.get("material"), "seam": seam, "ease": ease}
+    pieces = {p["name"]: p for p in info["pieces"] if p["name"]}
+    front = pieces.get("FRONT_PIECE") or pieces.get("BACK_PIECE")
+    if front:
+        design["bust"] = round((front["width"] - seam - ease / 4.0) * 4.0, 1)
+        design["torso_length"] = round(front["height"], 1)
+    sleeve = pieces.get("SLEEVE_PIECE")
+    if sleeve:
+        design["sleeve_width"] = round((sleeve["width"] - seam) * 2.0, 1)
+    return design
+
+
+def check_pattern(info, tolerance=SEAM_TOLERANCE):
+    """一致性检查，返回问题描述列表（空列表表示通过）"""
+    issues = []
+    names = [p["name"] for p in info["pieces"]]
+    for required in ("FRONT_PIECE", "BACK_PIECE", "SLEEVE_PIECE"):
+        if required not in names:
+            issues.append(f"missing {required}")
+    for key in ("garment", "material", "seam", "ease"):
+        if key not in info["legend"]:
+            issues.append(f"legend missing {key}")
+    seam = info["legend"].get("seam")
+    if info["measured_seam"] is None:
+        issues.append("no SEAM outline inside a CUT piece")
+    elif isinstance(seam, float) and abs(info["measured_seam"] - seam) > tolerance:
+        issues.append(f"seam allowance {info['measured_seam']} cm != legend {seam} cm")
+    pieces = {p["name"]: p for p in info["pieces"] if p["name"]}
+    front, back = pieces.get("FRONT_PIECE"), pieces.get("BACK_PIECE")
+    if front and back and (abs(front["width"] - back["width"]) > tolerance
+                           or abs(front["height"] - back["height"]) > tolerance):
+        issues.append("front/back piece sizes differ")
+    return issues
+
+
+def _process_file(args):
+    """进程池任务：读取 + 检查 + （可选）重出预览；异常记录在结果中而不是中断整批"""
+    path, preview_dir = args
+    out = {"path": path}
+    try:
+        info = read_pattern_dxf(path)
+        out["legend"] = info["legend"]
+        out["measured_seam"] = info["measured_seam"]
+        out["pieces"] = {p["name"] or "UNLABELED": [p["width"], p["height"]] for p in info["pieces"]}
+        out["issues"] = check_pattern(info)
+        if preview_dir:
+            from pattern_engine import generate_friendly_preview
+            name = os.path.splitext(os.path.basename(path))[0] + "_preview.png"
+            out["preview"] = generate_friendly_preview(design_from_pattern(info),
+                                                       output_path=os.path.join(preview_dir, name))
+    except Exception as e:
+        out["error"] = repr(e)
+    return out
+
+
+def iter_dxf_paths(directory):
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(".dxf"):
+                yield os.path.join(root, name)
+
+
+def scan_archive(directory, workers=None, preview_dir=None, chunksize=16):
+    """并行扫描目录下所有 DXF（分块派发到进程池），按输入顺序产出每个文件的结果 dict"""
+    if preview_dir:
+        os.makedirs(preview_dir, exist_ok=True)
+    jobs = ((p, preview_dir) for p in iter_dxf_paths(directory))
+    if workers == 1:
+        for job in jobs:
+            yield _process_file(job)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        for result in pool.map(_process_file, jobs, chunksize=chunksize):
+            yield result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量读取/检查 Looma 打版 DXF")
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数，1 为单进程）")
+    parser.add_argument("--preview-dir", help="重出预览图的目录（不指定则只做检查）")
+    parser.add_argument("--report", help="把逐文件结果写为 JSON Lines")
+    args = parser.parse_args(argv)
+
+    total = failed = errors = 0
+    report = open(args.report, "w", encoding="utf-8") if args.report else None
+    try:
+        for res in scan_archive(args.directory, workers=args.workers, preview_dir=args.preview_dir):
+            total += 1
+            if "error" in res:
+                errors += 1
+                print(f"ERROR {res['path']}: {res['error']}")
+            elif res["issues"]:
+                failed += 1
+                print(f"FAIL  {res['path']}: {'; '.join(res['issues'])}")
+            if report:
+                report.write(json.dumps(res, ensure_ascii=False) + "\n")
+    finally:
+        if report:
+            report.close()
+    print(f"{total} files, {total - failed - errors} ok, {failed} with issues, {errors} unreadable")
+    return 0 if failed == 0 and errors == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+# image_pipeline.py
+import io
+import hashlib
+from PIL import Image, ImageOps
+
+# 工作分辨率上限（长边像素）：解析主色/比例用不到原始手机大图
+WORKING_MAX_SIDE = 1024
+# 页面展示用缩略图（长边像素）
+THUMBNAIL_MAX_SIDE = 480
+
+
+def file_digest(data: bytes) -> str:
+    """上传文件内容的摘要，用作解码缓存的 key"""
+    return hashlib.sha1(data).hexdigest()
+
+
+def _bounded(img: Image.Image, max_side: int) -> Image.Image:
+    w, h = img.size
+    if max(w, h) <= max_side:
+        return img
+    out = img.copy()
+    out.thumbnail((max_side, max_side), Image.LANCZOS)
+    return out
+
+
+def decode_upload(data: bytes, max_side=WORKING_MAX_SIDE, thumb_side=THUMBNAIL_MAX_SIDE):
+    """
+    一次性解码上传图片：按 EXIF 方向校正，缩放到有界工作分辨率，并生成展示缩略图。
+    返回 (working, thumbnail)，两者均为已完全加载的 RGB PIL.Image。
+    """
+    img = Image.open(io.BytesIO(data))
+    # JPEG 可在解码阶段直接按 2 的幂次降采样，避免完整解码大图
+    try:
+        img.draft("RGB", (max_side, max_side))
+    except Exception:
+        pass
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    working = _bounded(img, max_side)
+    working.load()
+    thumbnail = _bounded(working, thumb_side)
+    return working, thumbnail
+
+
+def get_cached_upload(cache: dict, data: bytes, max_side=WORKING_MAX_SIDE, thumb_side=THUMBNAIL_MAX_SIDE):
+    """
+    从 cache（如 st.session_state 中的 dict）按文件摘要取已解码图片，未命中时解码一次并写入。
+    cache 只保留最近一张上传，避免会话内存随换图增长。
+    返回 {"digest", "working", "thumbnail"}。
+    """
+    digest = file_digest(data)
+    entry = cache.get("entry")
+    if entry and entry.get("digest") == digest:
+        return entry
+    working, thumbnail = decode_upload(data, max_side=max_side, thumb_side=thumb_side)
+    entry = {"digest": digest, "working": working, "thumbnail": thumbnail}
+    cache["entry"] = entry
+    return entry
@@ -0,0 +1,290 @@
+# load_test.py
+"""
+并发会话压测：模拟 N 个设计师同时走 解析 → 优化 → 生成 流程，统计吞吐、延迟分位数与 CPU/RSS 曲线。
+
+    python load_test.py --sessions 8 --iterations 5                  # 直接调用引擎函数
+    python load_test.py --sessions 4 --iterations 3 --mode apptest   # 通过 Streamlit AppTest 运行 app.py
+    python load_test.py --sessions 8 --compare reports/baseline.json # 与历史报告对比
+
+会话以线程运行在同一进程内，与单个 Streamlit 进程服务多个会话的情形一致（共同争用 GIL）。
+"""
+import os
+import sys
+import json
+import atexit
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+from datetime import datetime
+
+try:
+    import psutil
+except ImportError:  # psutil 可选：没有时用 resource/os.times 估算
+    psutil = None
+
+REPORT_DIR = "reports"
+SAMPLE_TEXTS = [
+    "酒红色真丝连衣裙，修身，胸围{bust}，腰围{waist}，长袖",
+    "藏青色棉衬衫，宽松，身高{height}cm，胸围{bust}cm，短袖",
+    "黑色牛仔外套，胸围{bust}，腰围{waist}，臀围{hip}",
+    "米白羊毛半身裙，高腰，腰围{waist}，臀围{hip}，A字",
+]
+
+
+def _sample_text(session, iteration):
+    n = session * 7 + iteration
+    return SAMPLE_TEXTS[n % len(SAMPLE_TEXTS)].format(
+        height=155 + n % 25, bust=80 + n % 20, waist=60 + n % 18, hip=86 + n % 20)
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _summarize(values):
+    v = sorted(values)
+    if not v:
+        return {"count": 0}
+    return {
+        "count": len(v),
+        "mean": round(sum(v) / len(v), 4),
+        "p50": round(_percentile(v, 50), 4),
+        "p95": round(_percentile(v, 95), 4),
+        "p99": round(_percentile(v, 99), 4),
+        "max": round(v[-1], 4),
+    }
+
+
+class ResourceSampler(threading.Thread):
+    """后台线程定期采样本进程 CPU 占用（%，可超过 100 表示多核）与 RSS（MB）"""
+
+    def __init__(self, interval=0.5):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._proc = psutil.Process() if psutil else None
+
+    def _cpu_seconds(self):
+        t = os.times()
+        return t.user + t.system
+
+    def _rss_mb(self):
+        if self._proc is not None:
+            return self._proc.memory_info().rss / (1024 * 1024)
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+        except (OSError, ValueError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    def run(self):
+        t0 = time.perf_counter()
+        last_t, last_cpu = t0, self._cpu_seconds()
+        while not self._stop_event.wait(self.interval):
+            now, cpu = time.perf_counter(), self._cpu_seconds()
+            self.samples.append({
+                "t": round(now - t0, 3),
+                "cpu_percent": round(100.0 * (cpu - last_cpu) / max(now - last_t, 1e-9), 1),
+                "rss_mb": round(self._rss_mb(), 1),
+            })
+            last_t, last_cpu = now, cpu
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _engine_session(session, iterations, results, work_dir):
+    """直接调用引擎函数；每个会话写自己的目录，避免并发覆盖 output/preview.png"""
+    from deepseek_engine import parse_with_deepseek
+    from ai_optimizer import optimize
+    from pattern_engine import generate_pattern
+
+    out_dir = os.path.join(work_dir, f"session_{session}")
+    os.makedirs(out_dir, exist_ok=True)
+    for i in range(iterations):
+        rec = {"session": session, "iteration": i}
+        t_start = time.perf_counter()
+        try:
+            t0 = time.perf_counter()
+            parsed = parse_with_deepseek(_sample_text(session, i))
+            rec["parse"] = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            optimized = optimize({k: v for k, v in parsed.items() if v is not None}, "智能模式")
+            rec["optimize"] = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            generate_pattern(optimized, output_dir=out_dir)
+            rec["generate"] = time.perf_counter() - t0
+        except Exception as e:
+            rec["error"] = repr(e)
+        rec["total"] = time.perf_counter() - t_start
+        results.append(rec)
+
+
+def _apptest_session(session, iterations, results, work_dir, app_path="app.py", timeout=120):
+    """通过 Streamlit AppTest 驱动真实的 app.py：填写描述触发解析，再点击生成"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    at.run()
+    for i in range(iterations):
+        rec = {"session": session, "iteration": i}
+        t_start = time.perf_counter()
+        try:
+            t0 = time.perf_counter()
+            at.text_area(key="notes_input").input(_sample_text(session, i)).run()
+            rec["parse"] = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            next(b for b in at.button if "生成" in b.label).click().run()
+            rec["generate"] = time.perf_counter() - t0
+            if at.exception:
+                rec["error"] = str(at.exception[0].value)
+            elif not at.success:
+                rec["error"] = "; ".join(e.value for e in at.error) or "no success message"
+        except Exception as e:
+            rec["error"] = repr(e)
+        rec["total"] = time.perf_counter() - t_start
+        results.append(rec)
+
+
+# apptest 模式的隔离输出目录：每个进程只创建一次，多次 run_load_test（如按并发数扫描）共用
+_ISOLATED_OUTPUT_DIR = None
+
+
+def _isolate_output():
+    """
+    apptest 模式运行真实 app.py，会把合成设计写入 OUTPUT_DIR 下的设计库、产物存档与相似版型索引；
+    因此把 OUTPUT_DIR/设计库指向本进程专用的临时目录（进程退出时删除）。
+    环境变量在引擎模块首次导入时读取，必须在导入之前设置；engine 模式直接传 output_dir，不需要隔离。
+    """
+    global _ISOLATED_OUTPUT_DIR
+    if _ISOLATED_OUTPUT_DIR is not None:
+        return _ISOLATED_OUTPUT_DIR
+    loaded = sys.modules.get("pattern_engine")
+    if loaded is not None and loaded.OUTPUT_DIR == os.environ.get("LOOMA_OUTPUT_DIR"):
+        # 调用方已自行通过环境变量指定了输出目录
+        _ISOLATED_OUTPUT_DIR = loaded.OUTPUT_DIR
+        return _ISOLATED_OUTPUT_DIR
+    if loaded is not None:
+        raise RuntimeError("pattern_engine already imported with OUTPUT_DIR="
+                           f"{loaded.OUTPUT_DIR!r}; run apptest mode before engine mode or in a fresh process")
+    work_dir = tempfile.mkdtemp(prefix="looma_apptest_")
+    os.environ["LOOMA_OUTPUT_DIR"] = work_dir
+    os.environ["LOOMA_DB_PATH"] = os.path.join(work_dir, "designs.sqlite3")
+    atexit.register(shutil.rmtree, work_dir, ignore_errors=True)
+    _ISOLATED_OUTPUT_DIR = work_dir
+    return work_dir
+
+
+def run_load_test(sessions=4, iterations=3, mode="engine", sample_interval=0.5):
+    """并发运行 sessions 个会话，每个会话执行 iterations 次完整流程，返回报告 dict（同一进程内可多次调用）"""
+    if mode == "engine":
+        target = _engine_session
+    else:
+        target = _apptest_session
+        _isolate_output()
+    work_dir = tempfile.mkdtemp(prefix="looma_load_")
+    results = []
+    sampler = ResourceSampler(sample_interval)
+    threads = [threading.Thread(target=target, args=(s, iterations, results, work_dir))
+               for s in range(sessions)]
+    sampler.start()
+    t0 = time.perf_counter()
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        wall = time.perf_counter() - t0
+        sampler.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    ok = [r for r in results if "error" not in r]
+    stages = ["parse", "optimize", "generate", "total"]
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {"mode": mode, "sessions": sessions, "iterations": iterations,
+                   "sample_interval": sample_interval},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count()},
+        "wall_seconds": round(wall, 3),
+        "completed": len(ok),
+        "errors": len(results) - len(ok),
+        "error_samples": [r["error"] for r in results if "error" in r][:5],
+        "throughput_per_sec": round(len(ok) / wall, 3) if wall > 0 else None,
+        "latency": {s: _summarize([r[s] for r in ok if s in r]) for s in stages},
+        "resources": {
+            "cpu_percent_max": max((x["cpu_percent"] for x in sampler.samples), default=None),
+            "rss_mb_max": max((x["rss_mb"] for x in sampler.samples), default=None),
+            "samples": sampler.samples,
+        },
+    }
+
+
+def format_report(report, baseline=None):
+    """生成可读摘要；给出 baseline 时附带与其相比的变化"""
+    def _delta(new, old):
+        if new is None or old in (None, 0):
+            return ""
+        return f" ({(new - old) / old * 100:+.0f}%)"
+
+    cfg = report["config"]
+    lines = [f"mode={cfg['mode']} sessions={cfg['sessions']} iterations={cfg['iterations']} "
+             f"wall={report['wall_seconds']}s completed={report['completed']} errors={report['errors']}"]
+    old_tp = baseline.get("throughput_per_sec") if baseline else None
+    lines.append(f"throughput: {report['throughput_per_sec']} flows/s{_delta(report['throughput_per_sec'], old_tp)}")
+    lines.append(f"{'stage':<10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for stage, s in report["latency"].items():
+        if not s.get("count"):
+            continue
+        old = (baseline or {}).get("latency", {}).get(stage, {})
+        row = f"{stage:<10}" + "".join(f"{s[p]:>10.3f}" for p in ("p50", "p95", "p99", "max"))
+        if old.get("p95"):
+            row += f"   p95{_delta(s['p95'], old['p95'])}"
+        lines.append(row)
+    res = report["resources"]
+    lines.append(f"cpu max: {res['cpu_percent_max']}%   rss max: {res['rss_mb_max']} MB")
+    for err in report["error_samples"]:
+        lines.append(f"error: {err}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Looma AI 并发会话压测")
+    parser.add_argument("--sessions", type=int, default=4, help="并发会话数")
+    parser.add_argument("--iterations", type=int, default=3, help="每个会话的完整流程次数")
+    parser.add_argument("--mode", choices=["engine", "apptest"], default="engine")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="CPU/RSS 采样间隔（秒）")
+    parser.add_argument("--output", help="报告路径（默认 reports/load_<mode>_<N>s_<时间>.json）")
+    parser.add_argument("--compare", help="对比用的历史报告 JSON")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(args.sessions, args.iterations, args.mode, args.sample_interval)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+
+    output = args.output or os.path.join(
+        REPORT_DIR, f"load_{args.mode}_{args.sessions}s_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"report saved: {output}")
+    return 0 if report["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,22 @@
 # pattern_engine.py
 import os
 import json
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, features
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import ezdxf
 import io
 
-OUTPUT_DIR = "output"
+# 可用环境变量 LOOMA_OUTPUT_DIR 改到其他目录（如压测时隔离设计库与产物）
+OUTPUT_DIR = os.environ.get("LOOMA_OUTPUT_DIR") or "output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 并发生成任务各自的临时输出目录（app 与 api_server 共用）
+JOB_DIR = os.path.join(OUTPUT_DIR, "jobs")
+
+# 预览分级：草图（秒出）→ 展示图（WebP/JPEG）；高清 PNG 只写入下载包
+DRAFT_DPI = 48
+PREVIEW_DPI = 160
+DISPLAY_MAX_WIDTH = {"mobile": 480, "desktop": 960}
 
 def _hex_to_rgb(hexstr):
     if not hexstr:
@@ -41,10 +49,9 @@ def _add_watermark_pil(img: Image.Image, text="张小鱼原创"):
     except Exception:
         return img
 
-def generate_friendly_preview(data: dict, output_path=None):
+def _build_preview_figure(data: dict):
     color = data.get("color") or "#FFB6C1"
     garment = data.get("garment", "设计")
-    material = data.get("material", "面料")
     bust = float(data.get("bust") or 88)
     height = float(data.get("height") or 165)
     shoulder = float(data.get("shoulder") or 38)
@@ -55,8 +62,7 @@ def generate_friendly_preview(data: dict, output_path=None):
     hem_depth = float(data.get("hem_depth") or 12)
 
     fig_w, fig_h = 6, 9
-    dpi = 160
-    fig = plt.figure(figsize=(fig_w, fig_h), dpi=dpi)
+    fig = plt.figure(figsize=(fig_w, fig_h), dpi=PREVIEW_DPI)
     ax = fig.add_axes([0,0,1,1])
     ax.set_xlim(0, 6)
     ax.set_ylim(0, 9)
@@ -84,19 +90,72 @@ def generate_friendly_preview(data: dict, output_path=None):
 
     ax.plot([main_x, main_x+main_w], [main_y+main_h*0.6, main_y+main_h*0.6], linestyle='--', color='#333', linewidth=1, zorder=5)
     ax.plot([main_x, main_x+main_w], [main_y+main_h*0.35, main_y+main_h*0.35], linestyle='--', color='#333', linewidth=1, zorder=5)
-    ax.text(3, 8.6, f"{garment} · {material} · {neck_type}", ha='center', fontsize=16, fontweight='bold', color="#111", zorder=6)
-    ax.text(3, 0.5, f"胸围参考: {int(bust)}cm    身高参考: {int(height)}cm    肩宽: {shoulder}cm", ha='center', fontsize=10, color="#333", zorder=6)
-
+    # 标注只写数据中真实存在的值（如从 DXF 反推的设计没有身高/肩宽/领型），缺失时不用绘图默认值冒充
+    title = [str(v) for v in (data.get("garment"), data.get("material"), data.get("neck_type")) if v]
+    ax.text(3, 8.6, " · ".join(title) or "设计", ha='center', fontsize=16, fontweight='bold', color="#111", zorder=6)
+    caption = []
+    if data.get("bust"):
+        caption.append(f"胸围参考: {int(bust)}cm")
+    if data.get("height"):
+        caption.append(f"身高参考: {int(height)}cm")
+    if data.get("shoulder"):
+        caption.append(f"肩宽: {shoulder}cm")
+    if caption:
+        ax.text(3, 0.5, "    ".join(caption), ha='center', fontsize=10, color="#333", zorder=6)
+
+    return fig
+
+def _render_figure(fig, dpi):
     buf = io.BytesIO()
-    plt.savefig(buf, dpi=dpi, bbox_inches='tight', pad_inches=0.1)
-    plt.close(fig)
+    fig.savefig(buf, dpi=dpi, bbox_inches='tight', pad_inches=0.1)
     buf.seek(0)
     pil_img = Image.open(buf).convert('RGB')
-    pil_img = _add_watermark_pil(pil_img, "张小鱼原创")
+    return _add_watermark_pil(pil_img, "张小鱼原创")
+
+def encode_preview(img: Image.Image, fmt="WEBP", max_width=None, quality=80):
+    """把预览图编码为展示用的有损小图（WebP 不可用时退回 JPEG），返回 (bytes, format)"""
+    if max_width and img.width > max_width:
+        img = img.resize((max_width, int(img.height * max_width / img.width)), Image.LANCZOS)
+    fmt = fmt.upper()
+    if fmt == "WEBP" and not features.check("webp"):
+        fmt = "JPEG"
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=quality)
+    return buf.getvalue(), fmt
+
+def encode_preview_file(path, fmt="WEBP", max_width=None, quality=80):
+    """读取已保存的预览 PNG 并编码为展示小图，返回 (bytes, format)"""
+    with Image.open(path) as img:
+        return encode_preview(img.convert('RGB'), fmt=fmt, max_width=max_width, quality=quality)
+
+def generate_friendly_preview(data: dict, output_path=None, dpi=PREVIEW_DPI):
+    fig = _build_preview_figure(data)
+    try:
+        pil_img = _render_figure(fig, dpi)
+    finally:
+        plt.close(fig)
     preview_path = output_path or os.path.join(OUTPUT_DIR, "preview.png")
     pil_img.save(preview_path, format="PNG")
     return preview_path
 
+def iter_preview_tiers(data: dict, output_path=None, mobile=False, fmt="WEBP"):
+    """
+    渐进式预览：同一张 figure 先以 DRAFT_DPI 渲染草图，再以 PREVIEW_DPI 渲染高清图。
+    依次产出 ("draft", bytes, format) 与 ("display", bytes, format)，展示图按端宽度缩放并有损编码；
+    高清 PNG 写入 output_path（供下载包使用），不直接发往页面。
+    """
+    max_width = DISPLAY_MAX_WIDTH["mobile" if mobile else "desktop"]
+    fig = _build_preview_figure(data)
+    try:
+        draft = _render_figure(fig, DRAFT_DPI)
+        yield ("draft",) + encode_preview(draft, fmt=fmt, max_width=max_width, quality=60)
+        full = _render_figure(fig, PREVIEW_DPI)
+    finally:
+        plt.close(fig)
+    preview_path = output_path or os.path.join(OUTPUT_DIR, "preview.png")
+    full.save(preview_path, format="PNG")
+    yield ("display",) + encode_preview(full, fmt=fmt, max_width=max_width)
+
 def generate_dxf(data: dict, output_path=None):
     garment = data.get("garment", "design")
     if output_path is None:
@@ -163,10 +222,16 @@ def generate_dxf(data: dict, output_path=None):
     doc.saveas(output_path)
     return output_path
 
-def generate_pattern(data: dict):
-    preview_path = generate_friendly_preview(data, output_path=os.path.join(OUTPUT_DIR, "preview.png"))
-    dxf_path = generate_dxf(data, output_path=os.path.join(OUTPUT_DIR, f"{data.get('garment','design')}_pattern.dxf"))
-    json_path = os.path.join(OUTPUT_DIR, f"{data.get('garment','design')}_design.json")
+def generate_pattern(data: dict, preview_path=None, output_dir=None):
+    """
+    preview_path 指向已渲染好的高清预览（如 iter_preview_tiers 的产物）时不再重复渲染；
+    output_dir 用于并发任务各写各的目录（默认 OUTPUT_DIR）。
+    """
+    output_dir = output_dir or OUTPUT_DIR
+    if not preview_path or not os.path.exists(preview_path):
+        preview_path = generate_friendly_preview(data, output_path=os.path.join(output_dir, "preview.png"))
+    dxf_path = generate_dxf(data, output_path=os.path.join(output_dir, f"{data.get('garment','design')}_pattern.dxf"))
+    json_path = os.path.join(output_dir, f"{data.get('garment','design')}_design.json")
     with open(json_path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
     return {"status":"success", "preview": preview_path, "dxf": dxf_path, "json": json_path}
@@ -0,0 +1,234 @@
+# pattern_library.py
+import threading
+import numpy as np
+
+from design_store import MEASURE_FIELDS
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy 可选：没有时使用 numpy 向量化暴力搜索
+    cKDTree = None
+
+# 各维度的归一化尺度（cm）：差 1 个尺度 ≈ 同等程度的“不合身”
+MEASURE_SCALES = np.array([5.0, 4.0, 4.0, 4.0, 1.5, 2.0])
+# 缺失值按 ai_optimizer 的默认值补齐
+MEASURE_DEFAULTS = np.array([165.0, 88.0, 68.0, 94.0, 38.0, 40.0])
+# 分组超过该规模才建 KD 树，小分组暴力搜索更快
+KDTREE_MIN_SIZE = 2048
+# 新增设计缓冲区容量：达到后在锁外重建索引；保持很小，使每次查询附带的暴力扫描开销可忽略
+BUFFER_MAX_SIZE = 2048
+
+
+def measurement_vector(design: dict):
+    """把设计参数转换为原始尺寸向量（cm），缺失/非法值用默认值"""
+    out = MEASURE_DEFAULTS.copy()
+    for i, k in enumerate(MEASURE_FIELDS):
+        try:
+            v = design.get(k)
+            if v not in (None, ""):
+                out[i] = float(v)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+def _brute_knn(scaled, q, k):
+    """向量化暴力 k-NN，返回 (下标, 距离)，按距离升序"""
+    n = len(scaled)
+    k = min(k, n)
+    if k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    diff = scaled - q
+    d2 = np.einsum("ij,ij->i", diff, diff)
+    idx = np.argpartition(d2, k - 1)[:k] if k < n else np.arange(n)
+    idx = idx[np.argsort(d2[idx])]
+    return idx, np.sqrt(d2[idx])
+
+
+class _Group:
+    """
+    同一品类（及版型/面料）下的设计集合。
+    已建索引部分用 KD 树（小分组时暴力搜索）；新增设计先写入容量固定的小缓冲区（已归一化），
+    查询时与索引一并搜索。缓冲区满后由 PatternLibrary 在锁外重建索引再替换（见 snapshot/swap）。
+    以下方法都须在 PatternLibrary 的锁内调用。
+    """
+
+    def __init__(self):
+        dim = len(MEASURE_FIELDS)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._raw = np.empty((0, dim))
+        self._scaled = self._raw
+        self._tree = None
+        self._buf_ids = []
+        self._buf_raw = np.empty((BUFFER_MAX_SIZE, dim))
+        self._buf_scaled = np.empty((BUFFER_MAX_SIZE, dim))
+        self.rebuilding = False
+
+    def __len__(self):
+        return len(self._ids) + len(self._buf_ids)
+
+    def needs_rebuild(self):
+        return not self.rebuilding and len(self._buf_ids) >= BUFFER_MAX_SIZE
+
+    def add(self, design_id, vec):
+        n = len(self._buf_ids)
+        if n == len(self._buf_raw):
+            # 重建进行中时缓冲区可能暂时超出容量
+            self._buf_raw = np.vstack([self._buf_raw, np.empty_like(self._buf_raw)])
+            self._buf_scaled = np.vstack([self._buf_scaled, np.empty_like(self._buf_scaled)])
+        self._buf_raw[n] = vec
+        self._buf_scaled[n] = vec / MEASURE_SCALES
+        self._buf_ids.append(design_id)
+
+    def snapshot(self):
+        """取出重建所需数据（已建部分 + 当前缓冲区副本），返回 (ids, raw, 已消费的缓冲条数)"""
+        n = len(self._buf_ids)
+        self.rebuilding = True
+        ids = np.concatenate([self._ids, np.asarray(self._buf_ids, dtype=np.int64)])
+        raw = np.concatenate([self._raw, self._buf_raw[:n]])
+        return ids, raw, n
+
+    def swap(self, built, consumed):
+        """换入锁外建好的索引，并丢弃已并入索引的前 consumed 条缓冲"""
+        self._ids, self._raw, self._scaled, self._tree = built
+        rest = len(self._buf_ids) - consumed
+        self._buf_raw[:rest] = self._buf_raw[consumed:consumed + rest]
+        self._buf_scaled[:rest] = self._buf_scaled[consumed:consumed + rest]
+        del self._buf_ids[:consumed]
+        self.rebuilding = False
+
+    def query(self, qvec, k):
+        q = qvec / MEASURE_SCALES
+        hits = []
+        if len(self._ids):
+            if self._tree is not None:
+                dist, idx = self._tree.query(q, k=min(k, len(self._ids)))
+                idx, dist = np.atleast_1d(idx), np.atleast_1d(dist)
+            else:
+                idx, dist = _brute_knn(self._scaled, q, k)
+            hits += [(int(self._ids[i]), float(d), self._raw[i]) for i, d in zip(idx, dist)]
+        n = len(self._buf_ids)
+        if n:
+            idx, dist = _brute_knn(self._buf_scaled[:n], q, k)
+            hits += [(self._buf_ids[i], float(d), self._buf_raw[i].copy()) for i, d in zip(idx, dist)]
+        hits.sort(key=lambda h: h[1])
+        return hits[:k]
+
+
+def _build_index(ids, raw):
+    """构建 _Group 的已建部分 (ids, raw, scaled, tree)；耗时操作，不持锁调用"""
+    ids = np.asarray(ids, dtype=np.int64)
+    raw = np.asarray(raw, dtype=float).reshape(-1, len(MEASURE_FIELDS))
+    scaled = raw / MEASURE_SCALES
+    tree = cKDTree(scaled) if cKDTree is not None and len(ids) >= KDTREE_MIN_SIZE else None
+    return ids, raw, scaled, tree
+
+
+class PatternLibrary:
+    """
+    历史版型的最近邻索引。
+    按 (品类, 版型, 面料) 与 品类 两级分组，在归一化尺寸向量上做 k-NN，
+    优先在完全同类的设计里找，找不到再放宽到同品类。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._groups = {}
+        self._last_id = 0
+
+    @classmethod
+    def from_store(cls, store):
+        lib = cls()
+        lib.refresh(store)
+        return lib
+
+    def refresh(self, store):
+        """
+        从设计库增量加载 id 大于已加载最大 id 的设计，返回新加载条数。
+        Streamlit 与 API（及多个 uvicorn worker）各自持有索引，查询前调用即可看到其他进程新写入的设计。
+        """
+        with self._refresh_lock:
+            rows = store.index_rows(since_id=self._last_id)
+            if not rows:
+                return 0
+            pending = {}
+            for row in rows:
+                design = dict(zip(["garment", "fit", "material"] + MEASURE_FIELDS, row[1:]))
+                vec = measurement_vector(design)
+                for key in self._keys(design):
+                    ids, vecs = pending.setdefault(key, ([], []))
+                    ids.append(row[0])
+                    vecs.append(vec)
+            with self._lock:
+                fresh = {key: v for key, v in pending.items() if key not in self._groups}
+            # 新出现的分组（首次加载时即全部分组）在锁外整组建索引
+            built = {key: _build_index(ids, vecs) for key, (ids, vecs) in fresh.items()}
+            with self._lock:
+                for key, (ids, vecs) in pending.items():
+                    if key in built and key not in self._groups:
+                        group = self._groups[key] = _Group()
+                        group.swap(built[key], 0)
+                    else:
+                        group = self._groups.setdefault(key, _Group())
+                        for design_id, vec in zip(ids, vecs):
+                            group.add(design_id, vec)
+            self._last_id = rows[-1][0]
+        self._rebuild_full_groups()
+        return len(rows)
+
+    @staticmethod
+    def _keys(design):
+        garment = design.get("garment") or ""
+        return [(garment, design.get("fit") or "", design.get("material") or ""), (garment,)]
+
+    def add(self, design_id, design: dict):
+        vec = measurement_vector(design)
+        with self._lock:
+            for key in self._keys(design):
+                self._groups.setdefault(key, _Group()).add(design_id, vec)
+        self._rebuild_full_groups()
+
+    def _rebuild_full_groups(self):
+        """缓冲区已满的分组：锁内取快照，锁外重建 KD 树，再在锁内换入；重建期间查询照常进行"""
+        with self._lock:
+            jobs = [(g, g.snapshot()) for g in self._groups.values() if g.needs_rebuild()]
+        for group, (ids, raw, consumed) in jobs:
+            try:
+                built = _build_index(ids, raw)
+            except Exception:
+                with self._lock:
+                    group.rebuilding = False
+                raise
+            with self._lock:
+                group.swap(built, consumed)
+
+    def __len__(self):
+        return sum(len(g) for key, g in self._groups.items() if len(key) == 1)
+
+    def nearest(self, design: dict, k=1, max_distance=None):
+        """
+        返回最接近的 k 个历史设计：[{"design_id", "distance", "exact_match", "deltas"}]。
+        distance 为归一化距离；deltas 为 {字段: 当前值 - 历史值}（cm）；exact_match 表示品类/版型/面料均一致。
+        """
+        qvec = measurement_vector(design)
+        exact_key, garment_key = self._keys(design)
+        def _within(found):
+            # 先按 max_distance 过滤，再决定是否放宽到同品类：同类里只有远处的设计时，仍要找同品类的近邻
+            return [h for h in found if max_distance is None or h[1] <= max_distance]
+
+        with self._lock:
+            hits = []
+            exact = self._groups.get(exact_key)
+            if exact is not None:
+                hits = [(h, True) for h in _within(exact.query(qvec, k))]
+            if len(hits) < k and garment_key in self._groups:
+                seen = {h[0][0] for h in hits}
+                more = _within(self._groups[garment_key].query(qvec, k + len(seen)))
+                hits += [(h, False) for h in more if h[0] not in seen][:k - len(hits)]
+        out = []
+        for (design_id, dist, raw), is_exact in hits:
+            deltas = {f: round(float(q - r), 1) + 0.0 for f, q, r in zip(MEASURE_FIELDS, qvec, raw)}
+            out.append({"design_id": design_id, "distance": round(dist, 3),
+                        "exact_match": is_exact, "deltas": deltas})
+        return out